@@ -17,18 +17,23 @@
 #     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import csv
 import itertools
+import operator
 from abc import ABC, abstractmethod
 from contextlib import contextmanager
 from pathlib import Path
-from typing import Callable, TextIO, Iterable, Iterator, Optional
+from typing import (Any, Callable, TextIO, Iterator, List, Optional,
+                    Sequence)
 
 from csv_transformer.en_functions import (
     FUNC_BY_TYPE, FUNC_BY_AGG, BINOP_BY_NAME, PREFIX_UNOP_BY_NAME,
-    INFIX_UNOP_BY_NAME)
+    INFIX_UNOP_BY_NAME, TYPECODE_BY_TYPE, ACCUMULATOR_BY_AGG,
+    ACCUMULATOR_BY_AGG_BY_TYPECODE)
 from csv_transformer.transformation import (
     TransformationJsonParser, improve_header, JSONValue, TransformationBuilder,
     Transformation, Expression, ExpressionParser, TypedRow)
 
+READ_BUFFER_SIZE = 1 << 20
+
 
 class CsvIn:
     def __init__(self, path: Path, encoding: str, fmtparams: JSONValue):
@@ -38,7 +43,8 @@ class CsvIn:
 
     @contextmanager
     def reader(self) -> csv.reader:
-        with self.path.open("r", encoding=self.encoding) as s:
+        with self.path.open("r", encoding=self.encoding, newline="",
+                            buffering=READ_BUFFER_SIZE) as s:
             yield csv.reader(s, **self.fmtparams)
 
 
@@ -112,7 +118,8 @@ def create_executor(transformation_dict: JSONValue,
         csv_out_dict = transformation_dict.pop("csv_out", {})
     transformation_builder = TransformationBuilder(
         risky, "it", FUNC_BY_TYPE, FUNC_BY_AGG, BINOP_BY_NAME,
-        PREFIX_UNOP_BY_NAME, INFIX_UNOP_BY_NAME)
+        PREFIX_UNOP_BY_NAME, INFIX_UNOP_BY_NAME, TYPECODE_BY_TYPE,
+        ACCUMULATOR_BY_AGG, ACCUMULATOR_BY_AGG_BY_TYPECODE)
     transformation = TransformationJsonParser(transformation_builder).parse(
         transformation_dict)
     csv_out = parse_json_csv_out(transformation_builder.expression_parser(),
@@ -130,8 +137,7 @@ class Executor:
 
     def execute(self, csv_in: CsvIn) -> Path:
         with csv_in.reader() as reader, self._csv_out.writer(csv_in) as writer:
-            for row in self.rows(reader):
-                writer.writerow(row)
+            writer.writerows(self.rows(reader))
 
         return self._csv_out.path(csv_in.path)
 
@@ -140,44 +146,97 @@ class Executor:
         header = next(reader)
         clean_header = transformation.add_fields(header)
         clean_header = improve_header(clean_header)
+        binding = transformation.bind_header(clean_header)
         # yield file header
-        yield transformation.file_header(clean_header)
+        yield binding.file_header
         # the id header
-        col_ids = transformation.col_ids(clean_header)
-        visible_col_ids = transformation.visible_col_ids(clean_header)
+        col_ids = binding.col_ids
+        to_row = self._row_getter(binding.visible_col_ids)
         if transformation.has_agg():
             if transformation.has_order():
                 for value_by_id in sorted(
-                        self._single_rows(reader, col_ids),
+                        self._single_rows(reader),
                         key=transformation.create_key(col_ids)):
-                    yield [value_by_id.get(i, "") for i in visible_col_ids]
+                    yield to_row(value_by_id)
             else:
-                for value_by_id in self._single_rows(reader, col_ids):
-                    yield [value_by_id.get(i, "") for i in visible_col_ids]
+                for value_by_id in self._single_rows(reader):
+                    yield to_row(value_by_id)
         else:
             if transformation.has_order():
                 for value_by_id in sorted(
-                        self._agg_rows(reader, col_ids),
+                        self._agg_rows(reader),
                         key=transformation.create_key(col_ids)):
-                    yield [value_by_id.get(i, "") for i in visible_col_ids]
+                    yield to_row(value_by_id)
+            elif transformation.is_pass_through():
+                # no dict per row: take the values from the list
+                to_row = self._position_getter(
+                    transformation.visible_positions())
+                for row in itertools.islice(reader, self._limit):
+                    yield to_row(row)
             else:
-                for value_by_id in self._agg_rows(reader, col_ids):
-                    yield [value_by_id.get(i, "") for i in visible_col_ids]
+                for value_by_id in self._agg_rows(reader):
+                    yield to_row(value_by_id)
+
+    @staticmethod
+    def _row_getter(visible_col_ids: List[str]
+                    ) -> Callable[[TypedRow], Sequence[Any]]:
+        """
+        :param visible_col_ids: the ids of the output cols
+        :return: a function that returns the output values of a row. The
+                 missing values (short rows) are empty.
+        """
+
+        def slow_getter(value_by_id: TypedRow) -> List[Any]:
+            return [value_by_id.get(i, "") for i in visible_col_ids]
+
+        if len(visible_col_ids) < 2:  # itemgetter would not return a tuple
+            return slow_getter
+
+        getter = operator.itemgetter(*visible_col_ids)
+
+        def aux(value_by_id: TypedRow) -> Sequence[Any]:
+            try:
+                return getter(value_by_id)
+            except KeyError:
+                return slow_getter(value_by_id)
+
+        return aux
+
+    @staticmethod
+    def _position_getter(positions: List[int]
+                         ) -> Callable[[List[str]], Sequence[Any]]:
+        """
+        :param positions: the positions of the output cols in the raw rows
+        :return: a function that returns the output values of a raw row. The
+                 missing values (short rows) are empty.
+        """
+
+        def slow_getter(row: List[str]) -> List[Any]:
+            return [row[i] if i < len(row) else "" for i in positions]
+
+        if len(positions) < 2:  # itemgetter would not return a tuple
+            return slow_getter
+
+        getter = operator.itemgetter(*positions)
+
+        def aux(row: List[str]) -> Sequence[Any]:
+            try:
+                return getter(row)
+            except IndexError:
+                return slow_getter(row)
+
+        return aux
 
-    def _single_rows(
-            self, reader: TextIO, col_ids: Iterable[str]) -> Iterator[TypedRow]:
+    def _single_rows(self, reader: TextIO) -> Iterator[TypedRow]:
         for row in itertools.islice(reader, self._limit):
-            value_by_id = dict(zip(col_ids, row))
-            self._transformation.take_or_ignore(value_by_id)
+            self._transformation.take_or_ignore(row)
 
         for value_by_id in self._transformation.agg_rows():
             if self._transformation.agg_filter(value_by_id):
                 yield value_by_id
 
-    def _agg_rows(
-            self, reader: TextIO, col_ids: Iterable[str]) -> Iterator[TypedRow]:
+    def _agg_rows(self, reader: TextIO) -> Iterator[TypedRow]:
         for row in itertools.islice(reader, self._limit):
-            value_by_id = dict(zip(col_ids, row))
-            value_by_id = self._transformation.transform(value_by_id)
+            value_by_id = self._transformation.transform(row)
             if value_by_id is not None:
                 yield value_by_id
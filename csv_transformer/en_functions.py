@@ -24,9 +24,12 @@ import re
 import statistics
 
 from csv_transformer.functions import to_date, to_datetime, to_date_or_datetime, \
-    add_years, add_months, age, case, str_to_float, str_to_date, \
-    str_to_datetime, datetime_from_us_format, date_from_us_format, str_to_int, \
-    str_to_decimal, to_path, with_stem, with_filename
+    add_years, add_months, age, case, if_then_else, str_to_float, \
+    str_to_date, str_to_datetime, datetime_from_us_format, \
+    date_from_us_format, str_to_int, str_to_decimal, to_path, with_stem, \
+    with_filename, strpdate, strpdatetime, CountAccumulator, \
+    SumAccumulator, MinAccumulator, MaxAccumulator, FirstAccumulator, \
+    LastAccumulator, mean
 from csv_transformer.simple_eval import Function, PrefixUnOp, BinOp
 
 BINOP_BY_NAME = {
@@ -37,7 +40,7 @@ BINOP_BY_NAME = {
         BinOp("/", 3, True, operator.truediv),
         BinOp("%", 3, True, operator.mod),
         BinOp("+", 4, True, operator.add),
-        BinOp("-", 4, True, lambda a, b: a - b),
+        BinOp("-", 4, True, operator.sub),
         BinOp("<", 6, True, operator.lt),
         BinOp("<=", 6, True, operator.le),
         BinOp("==", 6, True, operator.eq),
@@ -69,8 +72,8 @@ PREFIX_UNOP_BY_NAME = {
         Function("sign", lambda x: -1 if x < 0 else 1 if x > 0 else 0),
         Function("sqrt", math.sqrt),
 
-        Function("random", random.random),
-        Function("randint", random.randint),
+        Function("random", random.random, pure=False),
+        Function("randint", random.randint, pure=False),
 
         Function("cos", math.cos),
         Function("sin", math.sin),
@@ -100,9 +103,9 @@ PREFIX_UNOP_BY_NAME = {
         # https://www.postgresql.org/docs/current/functions-formatting.html
         Function("int", int),
         Function("float", float),
-        Function("strpdate", lambda s, f: dt.datetime.strptime(s, f).date()),
+        Function("strpdate", strpdate),
         Function("strfdate", lambda d, f: dt.datetime.strftime(d, f)),
-        Function("strpdatetime", dt.datetime.strptime),
+        Function("strpdatetime", strpdatetime),
         Function("strfdatetime", dt.datetime.strftime),
         Function("str", str),
         Function("date", to_date),
@@ -121,7 +124,7 @@ PREFIX_UNOP_BY_NAME = {
                  lambda d, i: to_datetime(d) + dt.timedelta(minutes=i)),
         Function("add_seconds",
                  lambda d, i: to_datetime(d) + dt.timedelta(seconds=i)),
-        Function("age", age),
+        Function("age", age, pure=False),  # age(d) uses now
         Function("day", lambda d: to_date(d).day),
         Function("month", lambda d: to_date(d).month),
         Function("year", lambda d: to_date(d).year),
@@ -130,7 +133,7 @@ PREFIX_UNOP_BY_NAME = {
         Function("second", lambda d: to_datetime(d).second),
 
         # https://www.postgresql.org/docs/current/functions-conditional.html
-        Function("if", lambda x, y, z: y if x else z),
+        Function("if", if_then_else),
         Function("case", case),
 
         # path
@@ -157,9 +160,9 @@ FUNC_BY_AGG = {
     "first": lambda xs: xs[0],
     "last": lambda xs: xs[-1],
     "count": len,
-    "count_distinct": len,
+    "count_distinct": lambda xs: len(set(xs)),
     "sum": sum,
-    "mean": statistics.mean,
+    "mean": mean,
     "median": statistics.median,
     "stdev": statistics.stdev,
     "pstdev": statistics.pstdev,
@@ -183,3 +186,28 @@ FUNC_BY_TYPE = {
     "datetime": str_to_datetime,
     "datetime_us": datetime_from_us_format
 }
+
+# the values of those types are aggregated in arrays
+TYPECODE_BY_TYPE = {
+    "int": "q",
+    "float": "d",
+    "float_us": "d",
+}
+
+# those aggregations do not need to keep the values
+ACCUMULATOR_BY_AGG = {
+    "first": FirstAccumulator,
+    "last": LastAccumulator,
+    "count": CountAccumulator,
+    "min": MinAccumulator,
+    "max": MaxAccumulator,
+}
+
+# those aggregations do not need to keep the values stored in arrays of this
+# typecode. Since Python 3.12, the builtin `sum` of floats is compensated: a
+# running total of floats would differ.
+ACCUMULATOR_BY_AGG_BY_TYPECODE = {
+    "q": {
+        "sum": SumAccumulator,
+    },
+}
@@ -15,15 +15,32 @@
 #
 #     You should have received a copy of the GNU General Public License
 #     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import array
 import datetime as dt
 import decimal
+import functools
 import re
+import statistics
+import unicodedata
+from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Union, Optional, Tuple, Any
+from typing import Union, Optional, Tuple, Any, Sequence
 
 IntoDate = Union[str, dt.date, dt.datetime]
 IntoDatetime = IntoDate
 
+SPACE_REGEX = re.compile(r"\s+")
+
+# the values of a date column repeat a lot: the parsed strings are cached.
+# Dates and datetimes are immutable, hence safe to share.
+PARSED_DATE_CACHE_SIZE = 4096
+
+# the parsing of those directives depends on the current locale: a cached
+# result may be stale
+LOCALE_DIRECTIVE_REGEX = re.compile(r"%[aAbBcpxX]")
+
+_NO_VALUE = object()
+
 
 def to_date(v: IntoDate) -> dt.date:
     if isinstance(v, str):
@@ -118,6 +135,11 @@ def age(last: dt.date, first: Optional[dt.date] = None) -> Tuple[int, int, int]:
     return years, months, days
 
 
+def if_then_else(condition: Any, value_if_true: Any, value_if_false: Any
+                 ) -> Any:
+    return value_if_true if condition else value_if_false
+
+
 def case(*args):
     args_count = len(args)
     assert args_count % 2 == 1
@@ -129,6 +151,7 @@ def case(*args):
 
 # TYPE FUNCTIONS #
 
+@functools.lru_cache(maxsize=PARSED_DATE_CACHE_SIZE)
 def str_to_datetime(s: str) -> dt.datetime:
     for fmt in ("%d/%m/%Y %H:%M:%S", "%d/%m/%y %H:%M:%S"):
         try:
@@ -136,9 +159,11 @@ def str_to_datetime(s: str) -> dt.datetime:
         except ValueError:
             pass
 
-    return datetime_from_us_format(s)
+    # the result is cached by this function, not by both
+    return datetime_from_us_format.__wrapped__(s)
 
 
+@functools.lru_cache(maxsize=PARSED_DATE_CACHE_SIZE)
 def datetime_from_us_format(s: str) -> dt.datetime:
     for fmt in (
             "%Y-%m-%d %H:%M:%S", "%y-%m-%d %H:%M:%S", "%Y%m%d %H%M%S",
@@ -151,6 +176,7 @@ def datetime_from_us_format(s: str) -> dt.datetime:
     raise ValueError()
 
 
+@functools.lru_cache(maxsize=PARSED_DATE_CACHE_SIZE)
 def date_from_us_format(s: str) -> dt.date:
     for fmt in ("%Y-%m-%d", "%y-%m-%d", "%Y%m%d", "%y%m%d"):
         try:
@@ -161,6 +187,7 @@ def date_from_us_format(s: str) -> dt.date:
     raise ValueError()
 
 
+@functools.lru_cache(maxsize=PARSED_DATE_CACHE_SIZE)
 def str_to_date(s: str) -> dt.date:
     for fmt in ("%d/%m/%Y", "%d/%m/%y"):
         try:
@@ -168,26 +195,63 @@ def str_to_date(s: str) -> dt.date:
         except ValueError:
             pass
 
-    return date_from_us_format(s)
+    # the result is cached by this function, not by both
+    return date_from_us_format.__wrapped__(s)
+
+
+def strpdatetime(s: str, fmt: str) -> dt.datetime:
+    if LOCALE_DIRECTIVE_REGEX.search(fmt):
+        return dt.datetime.strptime(s, fmt)
+    return _cached_strpdatetime(s, fmt)
+
+
+def strpdate(s: str, fmt: str) -> dt.date:
+    if LOCALE_DIRECTIVE_REGEX.search(fmt):
+        return dt.datetime.strptime(s, fmt).date()
+    return _cached_strpdate(s, fmt)
+
+
+@functools.lru_cache(maxsize=PARSED_DATE_CACHE_SIZE)
+def _cached_strpdatetime(s: str, fmt: str) -> dt.datetime:
+    return dt.datetime.strptime(s, fmt)
+
+
+@functools.lru_cache(maxsize=PARSED_DATE_CACHE_SIZE)
+def _cached_strpdate(s: str, fmt: str) -> dt.date:
+    return dt.datetime.strptime(s, fmt).date()
 
 
 def str_to_int(s: str) -> int:
-    s = re.sub(r"\s+", "", s)
+    s = SPACE_REGEX.sub("", s)
     return int(s)
 
 
 def str_to_float(s: str) -> float:
-    s = re.sub(r"\s+", "", s)
+    s = SPACE_REGEX.sub("", s)
     s = s.replace(',', '.')
     return float(s)
 
 
 def str_to_decimal(s: str) -> decimal.Decimal:
-    s = re.sub(r"\s+", "", s)
+    s = SPACE_REGEX.sub("", s)
     s = s.replace(',', '.')
     return decimal.Decimal(s)
 
 
+def mean(values: Sequence[Any]) -> Any:
+    """
+    As `statistics.mean`, but the ints of an array are summed in C: the
+    division of two ints is correctly rounded, hence the result is the same.
+    """
+    if isinstance(values, array.array) and values.typecode == "q" and values:
+        total = sum(values)
+        count = len(values)
+        if total % count == 0:
+            return total // count
+        return total / count
+    return statistics.mean(values)
+
+
 def id_func(x: Any) -> Any: return x
 
 
@@ -197,13 +261,128 @@ def true_func(_x: Any) -> Any: return True
 def empty_string_func(*_x: Any) -> Any: return ""
 
 
+class Accumulator(ABC):
+    """
+    Aggregates the values as they come, instead of keeping them all.
+    """
+
+    @abstractmethod
+    def append(self, value: Any):
+        pass
+
+    @abstractmethod
+    def result(self) -> Any:
+        pass
+
+
+def accumulator_result(accumulator: Accumulator) -> Any:
+    return accumulator.result()
+
+
+class CountAccumulator(Accumulator):
+    def __init__(self):
+        self._count = 0
+
+    def append(self, _value: Any):
+        self._count += 1
+
+    def result(self) -> int:
+        return self._count
+
+
+class SumAccumulator(Accumulator):
+    def __init__(self):
+        self._total = 0
+
+    def append(self, value: Any):
+        self._total = self._total + value
+
+    def result(self) -> Any:
+        return self._total
+
+
+class MinAccumulator(Accumulator):
+    """
+    As `min`, keeps the first of the smallest values.
+    """
+
+    def __init__(self):
+        self._min = _NO_VALUE
+
+    def append(self, value: Any):
+        if self._min is _NO_VALUE or value < self._min:
+            self._min = value
+
+    def result(self) -> Any:
+        if self._min is _NO_VALUE:
+            raise ValueError("min of an empty sequence")
+        return self._min
+
+
+class MaxAccumulator(Accumulator):
+    """
+    As `max`, keeps the first of the largest values.
+    """
+
+    def __init__(self):
+        self._max = _NO_VALUE
+
+    def append(self, value: Any):
+        if self._max is _NO_VALUE or value > self._max:
+            self._max = value
+
+    def result(self) -> Any:
+        if self._max is _NO_VALUE:
+            raise ValueError("max of an empty sequence")
+        return self._max
+
+
+class FirstAccumulator(Accumulator):
+    def __init__(self):
+        self._first = _NO_VALUE
+
+    def append(self, value: Any):
+        if self._first is _NO_VALUE:
+            self._first = value
+
+    def result(self) -> Any:
+        if self._first is _NO_VALUE:
+            raise IndexError("no first value")
+        return self._first
+
+
+class LastAccumulator(Accumulator):
+    def __init__(self):
+        self._last = _NO_VALUE
+
+    def append(self, value: Any):
+        self._last = value
+
+    def result(self) -> Any:
+        if self._last is _NO_VALUE:
+            raise IndexError("no last value")
+        return self._last
+
+
+class _AsciiByOrdinal(dict):
+    """
+    A table for `str.translate`: the ASCII part of the NFKD decomposition of
+    each char, computed on first use.
+    """
+
+    def __missing__(self, ordinal: int) -> str:
+        ascii_str = unicodedata.normalize('NFKD', chr(ordinal)).encode(
+            'ascii', 'ignore').decode('ascii')
+        self[ordinal] = ascii_str
+        return ascii_str
+
+
+_ASCII_BY_ORDINAL = _AsciiByOrdinal()
+
+
 def normalize(s: str) -> str:
-    import unicodedata
-    s = unicodedata.normalize('NFKD', s).encode('ascii', 'ignore').decode(
-        'ascii')
+    if not s.isascii():
+        s = s.translate(_ASCII_BY_ORDINAL)
     s = SPACE_REGEX.sub("_", s)
     s = s.lower()
     return s
-
-
-SPACE_REGEX = re.compile(r"\s+")
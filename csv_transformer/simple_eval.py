@@ -16,8 +16,10 @@
 #     You should have received a copy of the GNU General Public License
 #     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import sys
 import tokenize
 from abc import ABC
+from operator import itemgetter
 from io import BytesIO
 from token import NUMBER, STRING, NEWLINE, ENDMARKER, NAME, OP
 
@@ -26,13 +28,17 @@ try:
 except:
     ENCODING = 59
 
-from typing import (Any, Callable, Iterator, List, Mapping, Optional, Union)
+from typing import (Any, Callable, Iterator, List, Mapping, Optional, Set,
+                    Union, Sequence)
+
+from csv_transformer.functions import case, if_then_else
 
 
 class Literal:
     """
     A literal: any value_str
     """
+    __slots__ = ("value",)
 
     def __init__(self, value: Any):
         self.value = value
@@ -48,6 +54,7 @@ class Identifier:
     """
     An identifier
     """
+    __slots__ = ("name",)
 
     def __init__(self, name: str):
         self.name = name
@@ -60,21 +67,29 @@ class Identifier:
 
 
 class Op(ABC):
+    """
+    An operator or a function. `pure` is False if the result may change
+    between two calls with the same arguments (e.g. random).
+    """
+    __slots__ = ("name", "precedence", "left_associative", "func", "pure")
+
     def __init__(self, name: str, precedence: int, left_associative,
-                 func: Optional[Callable]):
+                 func: Optional[Callable], pure: bool = True):
         self.name = name
         self.precedence = precedence
         self.left_associative = left_associative
         self.func = func
+        self.pure = pure
 
 
 class Function(Op):
     """
     A function
     """
+    __slots__ = ()
 
-    def __init__(self, name: str, func: Callable):
-        Op.__init__(self, name, 1, False, func)
+    def __init__(self, name: str, func: Callable, pure: bool = True):
+        Op.__init__(self, name, 1, False, func, pure)
 
     def __repr__(self):
         return "Function({})".format(repr(self.name))
@@ -87,6 +102,7 @@ class BinOp(Op):
     """
     A binary operator
     """
+    __slots__ = ()
 
     def __repr__(self):
         return "BinOp({})".format(repr(self.name))
@@ -99,6 +115,7 @@ class PrefixUnOp(Op):
     """
     A unary operator
     """
+    __slots__ = ()
 
     def __repr__(self):
         return "PrefixUnOp({})".format(repr(self.name))
@@ -111,6 +128,7 @@ class InfixUnOp(Op):
     """
     A unary operator
     """
+    __slots__ = ()
 
     def __repr__(self):
         return "InfixUnOp({})".format(repr(self.name))
@@ -206,7 +224,9 @@ class ShuntingYard:
                     self._operand_stack, self._operator_stack,
                     self._expect_binop))
 
-        self._operand_stack.extend(self._operator_stack[::-1])
+        self._operator_stack.reverse()
+        self._operand_stack.extend(self._operator_stack)
+        self._operator_stack.clear()
         if self._debug:
             print("T: # | Opd: {} | Opr: [] | expB2: {}".format(
                 self._operand_stack,
@@ -300,7 +320,19 @@ class ShuntingYard:
         return current_token.type == OP and current_token.string == "("
 
 
-def evaluate(tokens: List[Any],
+def identifiers(tokens: List[Any]) -> List[str]:
+    """
+    :param tokens: the tokens, as returned by `ShuntingYard.process`
+    :return: the names of the identifiers, without duplicates
+    """
+    names = []
+    for token in tokens:
+        if isinstance(token, Identifier) and token.name not in names:
+            names.append(token.name)
+    return names
+
+
+def evaluate(tokens: Sequence[Any],
              value_by_name: Optional[Mapping[str, Any]] = None) -> Any:
     stack = []
     for token in tokens:
@@ -318,9 +350,10 @@ def evaluate(tokens: List[Any],
         elif isinstance(token, Function):
             args = []
             y = stack.pop()
-            while y != STOP:
-                args.insert(0, y)
+            while y is not STOP:
+                args.append(y)
                 y = stack.pop()
+            args.reverse()
             stack.append(token.func(*args))
         elif token is STOP:
             stack.append(token)
@@ -328,3 +361,134 @@ def evaluate(tokens: List[Any],
             raise ValueError(token)
     return stack[0]
 
+
+def compile_tokens(tokens: Sequence[Any], arg_name: Optional[str] = None
+                   ) -> Callable[[Any], Any]:
+    """
+    Compile the tokens once to nested closures. The result gives the same
+    value as `evaluate`, without walking the tokens on every call. The pure
+    operators and functions that have only constant arguments are computed
+    once, here.
+
+    :param tokens: the tokens, as returned by `ShuntingYard.process`
+    :param arg_name: if not None, the only identifier of the tokens. The
+                     result is then a function of the value of this identifier.
+    :return: a function of the values by name, or of the value of `arg_name`
+    """
+    stack = []
+    constants = set()
+    for token in tokens:
+        if isinstance(token, Literal):
+            constant = _compile_literal(token.value)
+            constants.add(constant)
+            stack.append(constant)
+        elif isinstance(token, Identifier):
+            if arg_name is None:
+                stack.append(itemgetter(sys.intern(token.name)))
+            elif token.name == arg_name:
+                stack.append(_arg)
+            else:
+                raise ValueError(token.name)
+        elif isinstance(token, BinOp):
+            second = stack.pop()
+            first = stack.pop()
+            stack.append(_fold(
+                _compile_binop(token.func, first, second), token,
+                [first, second], constants))
+        elif isinstance(token, PrefixUnOp):
+            arg = stack.pop()
+            stack.append(_fold(_compile_unop(token.func, arg), token, [arg],
+                               constants))
+        elif isinstance(token, Function):
+            args = []
+            y = stack.pop()
+            while y is not STOP:
+                args.append(y)
+                y = stack.pop()
+            args.reverse()
+            stack.append(_fold(_compile_function(token.func, args), token,
+                               args, constants))
+        elif token is STOP:
+            stack.append(token)
+        else:
+            raise ValueError(token)
+    return stack[0]
+
+
+def _compile_literal(value: Any) -> Callable[[Any], Any]:
+    return lambda _value_by_name: value
+
+
+def _fold(compiled: Callable[[Any], Any], op: Op, args: List[Callable],
+          constants: Set[Callable]) -> Callable[[Any], Any]:
+    if not op.pure or not constants.issuperset(args):
+        return compiled
+
+    try:
+        value = compiled(None)
+    except Exception:  # keep the error for the evaluation
+        return compiled
+    constant = _compile_literal(value)
+    constants.add(constant)
+    return constant
+
+
+def _arg(value: Any) -> Any:
+    return value
+
+
+def _compile_binop(func: Callable, first: Callable, second: Callable
+                   ) -> Callable[[Any], Any]:
+    return lambda value_by_name: func(first(value_by_name),
+                                      second(value_by_name))
+
+
+def _compile_unop(func: Callable, arg: Callable) -> Callable[[Any], Any]:
+    return lambda value_by_name: func(arg(value_by_name))
+
+
+def _compile_function(func: Callable, args: List[Callable]
+                      ) -> Callable[[Any], Any]:
+    if len(args) == 1 and args[0] is _arg:
+        # e.g. float(it): call the function directly
+        return func
+
+    # only the selected branch is evaluated
+    if func is if_then_else and len(args) == 3:
+        return _compile_if(*args)
+    elif func is case and len(args) % 2 == 1:
+        return _compile_case(args)
+
+    if not args:
+        return lambda _value_by_name: func()
+    elif len(args) == 1:
+        arg = args[0]
+        return lambda value_by_name: func(arg(value_by_name))
+    elif len(args) == 2:
+        first, second = args
+        return lambda value_by_name: func(first(value_by_name),
+                                          second(value_by_name))
+    else:
+        return lambda value_by_name: func(*[arg(value_by_name)
+                                            for arg in args])
+
+
+def _compile_if(condition: Callable, if_true: Callable, if_false: Callable
+                ) -> Callable[[Any], Any]:
+    return lambda value_by_name: (if_true(value_by_name)
+                                  if condition(value_by_name)
+                                  else if_false(value_by_name))
+
+
+def _compile_case(args: List[Callable]) -> Callable[[Any], Any]:
+    pairs = list(zip(args[0:-1:2], args[1:-1:2]))
+    default = args[-1]
+
+    def case_func(value_by_name):
+        for condition, value in pairs:
+            if condition(value_by_name):
+                return value(value_by_name)
+        return default(value_by_name)
+
+    return case_func
+
@@ -16,15 +16,20 @@
 #     You should have received a copy of the GNU General Public License
 #     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import abc
+import array
 import collections
 import logging
+import operator
 import re
+import sys
+from types import CodeType
 from typing import (Mapping, List, Callable, Any, cast, Dict, Iterable,
-                    Optional, Iterator, Union)
+                    Optional, Iterator, Tuple, Union)
 
-from csv_transformer.functions import (id_func, true_func, normalize)
+from csv_transformer.functions import (
+    id_func, true_func, normalize, Accumulator, accumulator_result)
 from csv_transformer.simple_eval import (
-    tokenize_expr, evaluate, ShuntingYard)
+    tokenize_expr, ShuntingYard, identifiers, compile_tokens)
 
 JSONValue = Union[
     int, float, str, bool, Dict[str, "JSONValue"], List["JSONValue"]]
@@ -38,6 +43,11 @@ ColFilter = Callable[[Any], bool]
 ColRename = Callable[[str], str]
 Expression = Callable[[Any], Any]
 ColAgg = Callable[[List[Any]], Any]
+BoundColumn = Tuple[int, str, Optional[ColType], Optional[Expression],
+                    Optional[ColFilter]]
+
+# a sentinel for the missing column transformations
+_MISSING = object()
 
 
 # https://www.postgresql.org/docs/current/functions-aggregate.html
@@ -51,6 +61,9 @@ class DefaultColumnTransformation:
     def is_visible(self) -> bool:
         return self._visible
 
+    def get_id(self, name: str) -> str:
+        return self.rename(name)
+
     def rename(self, name: str) -> str:
         if self._normalize:
             return normalize(name)
@@ -69,6 +82,9 @@ class ColumnTransformation:
     def is_visible(self) -> bool:
         return self._visible
 
+    def has_filter(self) -> bool:
+        return self._filter is not true_func
+
     def col_filter(self, value: Any) -> bool:
         return self._filter(value)
 
@@ -84,40 +100,66 @@ class ColumnTransformation:
     def agg(self, values: List[Any]) -> Any:
         return self._agg(values)
 
+    def new_values(self) -> List[Any]:
+        return []
+
 
 class ExistingColumnTransformation(ColumnTransformation):
     def __init__(self, col_id: ColRename, col_visible: bool, col_type: ColType,
                  col_filter: ColFilter, col_map: Expression,
                  col_agg: Optional[ColAgg], col_rename: ColRename,
-                 col_order: int):
+                 col_order: int, col_typecode: Optional[str] = None,
+                 col_accumulator: Optional[Callable[[], Accumulator]] = None):
         ColumnTransformation.__init__(self, col_visible, col_filter, col_agg,
                                       col_order)
         self._id = col_id
         self._type = col_type
         self._map = col_map
         self._rename = col_rename
+        self._typecode = col_typecode
+        self._accumulator = col_accumulator
 
     def get_id(self, name: str) -> str:
         return self._id(name)
 
+    def has_type(self) -> bool:
+        return self._type is not id_func
+
     def type_value(self, value_str: str) -> Any:
         return self._type(value_str)
 
     def rename(self, name: str) -> str:
         return self._rename(name)
 
+    def has_map(self) -> bool:
+        return self._map is not id_func
+
     def col_map(self, value: Any) -> Any:
         return self._map(value)
 
+    def new_values(self) -> Union[List[Any], array.array, Accumulator]:
+        """
+        :return: a buffer for the values to aggregate. If the aggregation
+        has an accumulator, the values are not kept. Numeric values are
+        stored unboxed if the typecode is known.
+        """
+        if self._accumulator is not None:
+            return self._accumulator()
+        elif self._typecode is None:
+            return []
+        return array.array(self._typecode)
+
 
 class NewColumnDefinition(ColumnTransformation):
     def __init__(self, col_id_str: str, col_visible: bool,
                  col_filter: ColFilter, col_formula: EntityExpression,
-                 col_agg: Optional[ColAgg], col_name: str, col_order: int):
+                 col_formula_ids: List[str], col_agg: Optional[ColAgg],
+                 col_name: str, col_order: int):
         ColumnTransformation.__init__(self, col_visible, col_filter, col_agg,
                                       col_order)
         self._col_id_str = col_id_str
         self._formula = col_formula
+        self._formula_ids = col_formula_ids
         self._agg = col_agg
         self._name = col_name
 
@@ -127,22 +169,86 @@ class NewColumnDefinition(ColumnTransformation):
     def col_formula(self, typed_value_by_name: TypedRow) -> Any:
         return self._formula(typed_value_by_name)
 
+    def formula_ids(self) -> List[str]:
+        return self._formula_ids
+
     def name(self):
         return self._name
 
 
+def _tuple_getter(col_ids: List[str]) -> Callable[[TypedRow], Tuple]:
+    if len(col_ids) == 1:
+        col_id = col_ids[0]
+        return lambda value_by_id: (value_by_id[col_id],)
+    elif col_ids:
+        return operator.itemgetter(*col_ids)
+    else:
+        return lambda _value_by_id: ()
+
+
+class HeaderBinding:
+    """
+    The parts of a transformation that depend on the header of a file.
+
+    The type, map and filter functions are aligned on the existing columns
+    of the header. None stands for the identity / no filter. The key columns
+    are the visible, non aggregated columns that group the rows.
+
+    If the row filter only depends on existing columns, `filter_cols` and
+    `other_cols` split the columns in two lists of
+    (position, col_id, type_func, map_func, filter_func): the first one is
+    enough to evaluate the row filter. Otherwise, both are None.
+    """
+
+    def __init__(self, file_header: List[str], col_ids: List[Optional[str]],
+                 visible_col_ids: List[Optional[str]],
+                 existing_col_ids: List[str],
+                 type_funcs: List[Optional[ColType]],
+                 map_funcs: List[Optional[Expression]],
+                 filter_funcs: List[Optional[ColFilter]],
+                 key_col_ids: List[str],
+                 filter_cols: Optional[List[BoundColumn]] = None,
+                 other_cols: Optional[List[BoundColumn]] = None):
+        self.file_header = file_header
+        self.col_ids = col_ids
+        self.visible_col_ids = visible_col_ids
+        self.existing_col_ids = existing_col_ids
+        self.type_funcs = type_funcs
+        self.map_funcs = map_funcs
+        self.filter_funcs = filter_funcs
+        self.has_col_funcs = any(
+            func is not None for funcs in (type_funcs, map_funcs, filter_funcs)
+            for func in funcs)
+        self.key_col_ids = key_col_ids
+        self.key_getter = _tuple_getter(key_col_ids)
+        self.filter_cols = filter_cols
+        self.other_cols = other_cols
+
+
 class Transformation:
     def __init__(self, entity_filter: EntityFilter, agg_filter: EntityFilter,
                  default_column_transformation: DefaultColumnTransformation,
                  existing_col_transformation_by_name: Dict[
                      str, ExistingColumnTransformation],
                  new_col_definitions: List[NewColumnDefinition],
-                 extra_prefix: str, extra_count: int):
+                 extra_prefix: str, extra_count: int,
+                 entity_filter_ids: Optional[List[str]] = None):
+        """
+        :param entity_filter_ids: the ids used by the entity filter, if known
+        """
         self._entity_filter = entity_filter
+        self._entity_filter_ids = entity_filter_ids
         self._agg_filter = agg_filter
         self._default_column_transformation = default_column_transformation
         self._existing_col_transformation_by_name = existing_col_transformation_by_name
         self._new_col_definitions = new_col_definitions
+        # the formulas, in an order that respects the dependencies
+        # the col ids are interned, like the names used by the expressions:
+        # the dict lookups of a row succeed on the identity check
+        self._new_col_plan = [
+            (sys.intern(nt.get_id()), nt.col_formula, nt.col_filter) for nt in
+            sort_new_col_definitions(new_col_definitions)
+        ]
         self._existing_col_transformation_by_id = {
             self._existing_col_id(n): v for n, v in
             existing_col_transformation_by_name.items()
@@ -154,167 +260,339 @@ class Transformation:
             **self._existing_col_transformation_by_id,
             **self._new_col_transformation_by_id
         }
+        self._agg_col_ids = {
+            col_id for col_id, ct in self._col_transformation_by_id.items()
+            if ct.has_agg()
+        }
+        self._ordered_col_ids = {
+            col_id for col_id, ct in self._col_transformation_by_id.items()
+            if ct.has_order()
+        }
         self._extra_prefix = extra_prefix
         self._extra_count = extra_count
-        self._values_by_id_by_key = {}
+        self._agg_col_transformations = [
+            (col_id, ct) for col_id, ct in
+            self._col_transformation_by_id.items() if ct.has_agg()
+        ]
+        self._values_by_id_by_key = collections.defaultdict(self._new_bucket)
+        self._binding_by_header = {}
+        self._binding = cast(Optional[HeaderBinding], None)
+        self._extra_fields_by_count = {}
 
     # PREPARE
 
     def add_fields(self, header: List[str]) -> List[str]:
-        if self._extra_count > 0:
-            return add_fields(header, self._extra_prefix, self._extra_count)
-        else:
+        count = self._extra_count - len(header)
+        if count <= 0:
             return header
 
-    def file_header(self, header: Iterable[str]) -> List[str]:
+        # the files of a run usually have the same width
+        extra_fields = self._extra_fields_by_count.get(count)
+        if extra_fields is None:
+            extra_fields = add_fields([], self._extra_prefix, count)
+            self._extra_fields_by_count[count] = extra_fields
+        return header + extra_fields
+
+    def bind_header(self, header: List[str]) -> HeaderBinding:
+        """
+        Bind the transformation to a header. This must be done before
+        processing the rows of a file. Files with the same header share the
+        same binding.
+
+        :param header: the clean header
+        :return: the binding
+        """
+        binding = self._get_binding(header)
+        self._binding = binding
+        return binding
+
+    def _get_binding(self, header: List[str]) -> HeaderBinding:
+        key = tuple(header)
+        binding = self._binding_by_header.get(key)
+        if binding is None:
+            binding = self._create_binding(header)
+            self._binding_by_header[key] = binding
+        return binding
+
+    def _create_binding(self, header: List[str]) -> HeaderBinding:
         # header contains the names of the existing cols
-        h = [self._existing_col_rename(n) for n in header if
-             self._existing_col_is_visible_by_name(n)]
-        h += [nt.name() for nt in self._new_col_definitions if nt.is_visible()]
-        return h
-
-    def col_ids(self, header: Iterable[str]) -> List[Optional[str]]:
-        return [self._existing_col_id(n) for n in header] + [
-            nt.get_id() for nt in self._new_col_definitions]
-
-    def visible_col_ids(self, header: Iterable[str]) -> List[Optional[str]]:
-        return [
-                   self._existing_col_id(n) for n in header
-                   if self._existing_col_is_visible_by_name(n)
-               ] + [
-                   nt.get_id() for nt in self._new_col_definitions
-                   if nt.is_visible()
-               ]
+        file_header = []
+        existing_col_ids = []
+        visible_col_ids = []
+        type_funcs = []
+        map_funcs = []
+        filter_funcs = []
+        for name in header:
+            ct = self._existing_col_transformation(name)
+            col_id = sys.intern(ct.get_id(name))
+            existing_col_ids.append(col_id)
+            if ct.is_visible():
+                file_header.append(ct.rename(name))
+                visible_col_ids.append(col_id)
+
+            ct = self._existing_col_transformation_by_id.get(col_id, _MISSING)
+            if ct is _MISSING:
+                type_funcs.append(None)
+                map_funcs.append(None)
+                filter_funcs.append(None)
+            else:
+                type_funcs.append(ct.type_value if ct.has_type() else None)
+                map_funcs.append(ct.col_map if ct.has_map() else None)
+                filter_funcs.append(
+                    ct.col_filter if ct.has_filter() else None)
+
+        file_header += [nt.name() for nt in self._new_col_definitions
+                        if nt.is_visible()]
+        col_ids = existing_col_ids + [
+            sys.intern(nt.get_id()) for nt in self._new_col_definitions]
+        visible_col_ids += [sys.intern(nt.get_id())
+                            for nt in self._new_col_definitions
+                            if nt.is_visible()]
+        key_col_ids = [
+            col_id for col_id in dict.fromkeys(
+                existing_col_ids + [col_id for col_id, _, _ in
+                                    self._new_col_plan])
+            if not self._col_is_agg(col_id)
+               and self._col_is_visible_by_id(col_id)
+        ]
+        filter_cols, other_cols = self._split_cols(
+            existing_col_ids, type_funcs, map_funcs, filter_funcs)
+        return HeaderBinding(file_header, col_ids, visible_col_ids,
+                             existing_col_ids, type_funcs, map_funcs,
+                             filter_funcs, key_col_ids, filter_cols,
+                             other_cols)
+
+    def _split_cols(self, existing_col_ids: List[str],
+                    type_funcs: List[Optional[ColType]],
+                    map_funcs: List[Optional[Expression]],
+                    filter_funcs: List[Optional[ColFilter]]
+                    ) -> Tuple[Optional[List[BoundColumn]],
+                               Optional[List[BoundColumn]]]:
+        if self._entity_filter_ids is None:
+            return None, None
+
+        entity_filter_ids = set(self._entity_filter_ids)
+        # the new cols are computed after the existing cols
+        if (not entity_filter_ids.isdisjoint(
+                self._new_col_transformation_by_id)
+                or not all(existing_col_ids.count(col_id) == 1
+                           for col_id in entity_filter_ids)):
+            return None, None
+
+        filter_cols = []
+        other_cols = []
+        for col in zip(range(len(existing_col_ids)), existing_col_ids,
+                       type_funcs, map_funcs, filter_funcs):
+            if col[1] in entity_filter_ids:
+                filter_cols.append(col)
+            else:
+                other_cols.append(col)
+        return filter_cols, other_cols
+
+    def file_header(self, header: List[str]) -> List[str]:
+        return self._get_binding(header).file_header
+
+    def col_ids(self, header: List[str]) -> List[Optional[str]]:
+        return self._get_binding(header).col_ids
+
+    def visible_col_ids(self, header: List[str]) -> List[Optional[str]]:
+        return self._get_binding(header).visible_col_ids
+
+    def _existing_col_transformation(self, name: str) -> Union[
+            ExistingColumnTransformation, DefaultColumnTransformation]:
+        return self._existing_col_transformation_by_name.get(
+            name, self._default_column_transformation)
 
     def _existing_col_id(self, name: str) -> str:
-        try:
-            return self._existing_col_transformation_by_name[name].get_id(name)
-        except KeyError:
-            return self._default_column_transformation.rename(name)
-
-    def _existing_col_is_visible_by_name(self, name: str) -> bool:
-        try:
-            return self._existing_col_transformation_by_name[name].is_visible()
-        except KeyError:
-            return self._default_column_transformation.is_visible()
-
-    def _existing_col_rename(self, name: str) -> str:
-        try:
-            return self._existing_col_transformation_by_name[name].rename(name)
-        except KeyError:
-            return self._default_column_transformation.rename(name)
+        return self._existing_col_transformation(name).get_id(name)
 
     def has_order(self) -> bool:
-        return any(self._col_has_order(col_id)
-                   for col_id in self._col_transformation_by_id)
+        return bool(self._ordered_col_ids)
 
     # DISPATCH
     def has_agg(self) -> bool:
-        return any(self._col_is_agg(col_id)
-                   for col_id in self._col_transformation_by_id)
+        return bool(self._agg_col_ids)
+
+    def is_pass_through(self) -> bool:
+        """
+        :return: True if the rows of the bound file are only projected on
+                 the visible cols: no function, new col, row filter or agg.
+        """
+        return (not self._binding.has_col_funcs and not self._new_col_plan
+                and self._entity_filter is true_func and not self.has_agg())
+
+    def visible_positions(self) -> List[int]:
+        """
+        :return: the positions of the visible cols in the rows of the bound
+                 file. The transformation must be a pass through.
+        """
+        # the last col wins, like in `transform`
+        position_by_id = {col_id: i for i, col_id in
+                          enumerate(self._binding.existing_col_ids)}
+        return [position_by_id[col_id]
+                for col_id in self._binding.visible_col_ids]
 
     def _col_has_order(self, col_id: str) -> bool:
-        try:
-            return self._col_transformation_by_id[col_id].has_order()
-        except KeyError:
-            return False
+        return col_id in self._ordered_col_ids
 
     def order(self, col_id: str) -> int:
-        try:
-            return self._col_transformation_by_id[col_id].order()
-        except KeyError:
+        ct = self._col_transformation_by_id.get(col_id, _MISSING)
+        if ct is _MISSING:
             return -1
+        return ct.order()
 
     def _col_is_agg(self, col_id: str) -> bool:
-        try:
-            return self._col_transformation_by_id[col_id].has_agg()
-        except KeyError:
-            return False
+        return col_id in self._agg_col_ids
 
     # NO AGG
 
-    def transform(self, value_by_id: StrRow) -> Optional[TypedRow]:
-        typed_value_by_id = self._type_row(value_by_id)
-        typed_value_by_id = self._extend_row(typed_value_by_id)
-        typed_value_by_id = self._map(typed_value_by_id)
-        # add new cols
-        if self._filter(typed_value_by_id):
-            return typed_value_by_id
+    def transform(self, values: List[str]) -> Optional[TypedRow]:
+        """
+        Type, map and filter the values in one pass, then add the new cols.
+        The transformation must be bound to the header.
+
+        The column filters are applied before the entity filter, and a row is
+        dropped as soon as a filter fails: the remaining values of the row are
+        not typed, mapped or computed, hence their errors are not raised.
+
+        :param values: the raw values, as read by the csv reader
+        :return: the typed row or None if the row is filtered out
+        """
+        binding = self._binding
+        # the formulas of the new cols see the values before the map
+        unmapped_value_by_id = {}
+        if binding.filter_cols is not None:
+            return self._transform_filter_first(binding, values)
+        elif binding.has_col_funcs:
+            typed_value_by_id = {}
+            for col_id, type_func, map_func, filter_func, value in zip(
+                    binding.existing_col_ids, binding.type_funcs,
+                    binding.map_funcs, binding.filter_funcs, values):
+                if type_func is not None:
+                    value = type_func(value)
+                if map_func is not None:
+                    unmapped_value_by_id[col_id] = value
+                    value = map_func(value)
+                if filter_func is not None and not filter_func(value):
+                    return None
+                typed_value_by_id[col_id] = value
         else:
-            return None
+            typed_value_by_id = dict(zip(binding.existing_col_ids, values))
 
-    def _type_row(self, value_by_id: StrRow) -> TypedRow:
-        return {i: self._type_value(i, v) for i, v in value_by_id.items()}
+        if self._new_col_plan:
+            if not self._extend_row(typed_value_by_id, unmapped_value_by_id):
+                return None
 
-    def _type_value(self, col_id: str, value: str) -> Any:
-        try:
-            return self._existing_col_transformation_by_id[col_id].type_value(
-                value)
-        except KeyError:
-            return value
-
-    def _filter(self, typed_value_by_id: TypedRow) -> bool:
-        if self._entity_filter(typed_value_by_id):
-            return all(
-                self._col_filter(col_id, value) for col_id, value in
-                typed_value_by_id.items())
+        if (self._entity_filter is true_func
+                or self._entity_filter(typed_value_by_id)):
+            return typed_value_by_id
         else:
-            return False
-
-    def _col_filter(self, col_id: str, value: Any) -> bool:
-        try:
-            return self._col_transformation_by_id[col_id].col_filter(value)
-        except KeyError:
-            return True
+            return None
 
-    def _map(self, typed_value_by_id: TypedRow) -> TypedRow:
-        return {
-            n: self._existing_col_map(n, v) for n, v in
-            typed_value_by_id.items()
-        }
+    def _transform_filter_first(self, binding: HeaderBinding,
+                                values: List[str]) -> Optional[TypedRow]:
+        """
+        The entity filter only depends on a few existing cols: evaluate it
+        before the other cols are typed and the new cols computed.
+        """
+        typed_value_by_id = {}
+        unmapped_value_by_id = {}
+        if not (self._transform_cols(binding.filter_cols, values,
+                                     typed_value_by_id, unmapped_value_by_id)
+                and self._entity_filter(typed_value_by_id)
+                and self._transform_cols(binding.other_cols, values,
+                                         typed_value_by_id,
+                                         unmapped_value_by_id)):
+            return None
 
-    def _existing_col_map(self, col_id: str, value: Any) -> Any:
-        try:
-            return self._existing_col_transformation_by_id[col_id].col_map(
-                value)
-        except KeyError:
-            return value
+        if self._new_col_plan:
+            if not self._extend_row(typed_value_by_id, unmapped_value_by_id):
+                return None
 
-    def _extend_row(self, typed_value_by_id: TypedRow) -> TypedRow:
-        for new_col in self._new_col_definitions:
-            typed_value_by_id[new_col.get_id()] = new_col.col_formula(
-                typed_value_by_id)
         return typed_value_by_id
 
+    @staticmethod
+    def _transform_cols(cols: List[BoundColumn], values: List[str],
+                        typed_value_by_id: Dict[str, Any],
+                        unmapped_value_by_id: Dict[str, Any]) -> bool:
+        n = len(values)
+        for position, col_id, type_func, map_func, filter_func in cols:
+            if position >= n:  # a short row
+                continue
+            value = values[position]
+            if type_func is not None:
+                value = type_func(value)
+            if map_func is not None:
+                unmapped_value_by_id[col_id] = value
+                value = map_func(value)
+            if filter_func is not None and not filter_func(value):
+                return False
+            typed_value_by_id[col_id] = value
+        return True
+
+    def _extend_row(self, typed_value_by_id: Dict[str, Any],
+                    unmapped_value_by_id: Dict[str, Any]) -> bool:
+        if unmapped_value_by_id:
+            formula_value_by_id = {**typed_value_by_id,
+                                   **unmapped_value_by_id}
+        else:
+            formula_value_by_id = typed_value_by_id
+
+        for col_id, col_formula, col_filter in self._new_col_plan:
+            value = col_formula(formula_value_by_id)
+            if not col_filter(value):
+                return False
+            typed_value_by_id[col_id] = value
+            formula_value_by_id[col_id] = value
+        return True
+
     # AGG
 
-    def take_or_ignore(self, value_by_id: StrRow):
+    def take_or_ignore(self, values: List[str]):
         """for agg"""
-        value_by_id = self._type_row(value_by_id)
-        value_by_id = self._extend_row(value_by_id)
-        typed_value_by_id = self._map(value_by_id)
-        if self._filter(typed_value_by_id):
-            key = tuple([
-                (i, typed_value_by_id[i]) for i in typed_value_by_id
-                if not self._col_is_agg(i) and self._col_is_visible_by_id(i)
-            ])
-            for col_id in self._existing_col_transformation_by_id:
-                if self._col_is_agg(col_id):
-                    self._values_by_id_by_key.setdefault(
-                        key, {}).setdefault(
-                        col_id, []).append(typed_value_by_id[col_id])
+        typed_value_by_id = self.transform(values)
+        if typed_value_by_id is not None:
+            binding = self._binding
+            try:
+                key = binding.key_getter(typed_value_by_id)
+            except KeyError:  # a short row
+                key = tuple([typed_value_by_id.get(i, _MISSING)
+                             for i in binding.key_col_ids])
+            values_by_id = self._values_by_id_by_key[key]
+            for col_id, _ct in self._agg_col_transformations:
+                value = typed_value_by_id[col_id]
+                try:
+                    values_by_id[col_id].append(value)
+                except OverflowError:  # the int does not fit into the array
+                    values = list(values_by_id[col_id])
+                    values.append(value)
+                    values_by_id[col_id] = values
+
+    def _new_bucket(self) -> Dict[str, Union[List[Any], array.array]]:
+        return {col_id: ct.new_values()
+                for col_id, ct in self._agg_col_transformations}
 
     def _col_is_visible_by_id(self, col_id: str) -> bool:
-        try:
-            return self._col_transformation_by_id[col_id].is_visible()
-        except KeyError:
+        ct = self._col_transformation_by_id.get(col_id, _MISSING)
+        if ct is _MISSING:
             return self._default_column_transformation.is_visible()
+        return ct.is_visible()
 
     def agg_rows(self) -> Iterator[TypedRow]:
-        for key, values_by_id in self._values_by_id_by_key.items():
-            row = dict(key)
-            for col_id, values in values_by_id.items():
-                row[col_id] = self._col_transformation_by_id[col_id].agg(values)
+        """
+        Aggregate the values taken so far. The buffers of a key are released
+        once its row is computed, and the next rows start with empty buffers.
+        The keys are the values of the key columns of the current binding.
+        """
+        key_col_ids = self._binding.key_col_ids
+        values_by_id_by_key = self._values_by_id_by_key
+        self._values_by_id_by_key = collections.defaultdict(self._new_bucket)
+        for key in list(values_by_id_by_key):
+            values_by_id = values_by_id_by_key.pop(key)
+            row = {col_id: value for col_id, value in zip(key_col_ids, key)
+                   if value is not _MISSING}
+            for col_id, ct in self._agg_col_transformations:
+                row[col_id] = ct.agg(values_by_id[col_id])
 
             yield row
 
@@ -326,6 +604,9 @@ class Transformation:
             [col_id for col_id in col_ids if self._col_has_order(col_id)],
             key=lambda col_id: abs(self.order(col_id)))
         signs = [1 if self.order(col_id) >= 0 else -1 for col_id in ordered_ids]
+        if ordered_ids and all(s == 1 for s in signs):
+            # a value (one col) or a tuple of values, without any multiply
+            return operator.itemgetter(*ordered_ids)
 
         def aux(value_by_id: TypedRow) -> Any:
             return tuple([s * value_by_id[col_id] for s, col_id in
@@ -334,6 +615,34 @@ class Transformation:
         return aux
 
 
+def sort_new_col_definitions(new_col_definitions: List[NewColumnDefinition]
+                             ) -> List[NewColumnDefinition]:
+    """
+    A new column may use other new columns: sort the definitions to compute
+    the dependencies first. The declaration order is kept otherwise.
+    """
+    definition_by_id = {nt.get_id(): nt for nt in new_col_definitions}
+    sorted_definitions = []
+    state_by_id = {}  # False: visiting, True: done
+
+    def visit(nt: NewColumnDefinition):
+        col_id = nt.get_id()
+        state = state_by_id.get(col_id)
+        if state is None:
+            state_by_id[col_id] = False
+            for formula_id in nt.formula_ids():
+                if formula_id != col_id and formula_id in definition_by_id:
+                    visit(definition_by_id[formula_id])
+            state_by_id[col_id] = True
+            sorted_definitions.append(nt)
+        elif not state:
+            raise ValueError("Circular definition of {}".format(col_id))
+
+    for new_col_definition in new_col_definitions:
+        visit(new_col_definition)
+    return sorted_definitions
+
+
 class EntityFilterParser:
     _logger = logging.getLogger(__name__)
 
@@ -342,20 +651,50 @@ class EntityFilterParser:
         self.binop_by_name = binop_by_name
         self.prefix_unop_by_name = prefix_unop_by_name
         self.infix_unop_by_name = infix_unop_by_name
+        self._tokens_by_str = {}
+        self._entity_filter_by_str = {}
 
     def parse(self, entity_filter_str: str) -> EntityFilter:
-        tokens = tokenize_expr(entity_filter_str)
-        tokens = ShuntingYard(False, self.binop_by_name,
-                              self.prefix_unop_by_name,
-                              self.infix_unop_by_name).process(tokens)
-        return lambda r: evaluate(tokens, r)
+        entity_filter = self._entity_filter_by_str.get(entity_filter_str)
+        if entity_filter is None:
+            entity_filter = compile_tokens(self._tokens(entity_filter_str))
+            self._entity_filter_by_str[entity_filter_str] = entity_filter
+        return entity_filter
+
+    def identifiers(self, entity_filter_str: str) -> List[str]:
+        return identifiers(self._tokens(entity_filter_str))
+
+    def _tokens(self, entity_filter_str: str) -> List[Any]:
+        tokens = self._tokens_by_str.get(entity_filter_str)
+        if tokens is None:
+            tokens = tokenize_expr(entity_filter_str)
+            tokens = ShuntingYard(False, self.binop_by_name,
+                                  self.prefix_unop_by_name,
+                                  self.infix_unop_by_name).process(tokens)
+            self._tokens_by_str[entity_filter_str] = tokens
+        return tokens
 
 
 class RiskyEntityFilterParser:
     _logger = logging.getLogger(__name__)
 
+    def __init__(self):
+        self._code_by_str = {}
+
     def parse(self, entity_filter_str: str) -> EntityFilter:
-        return lambda r: eval(entity_filter_str, {}, r)
+        code = self._compile(entity_filter_str)
+        return lambda r: eval(code, {}, r)
+
+    def identifiers(self, entity_filter_str: str) -> List[str]:
+        # a superset: the names of the functions are included
+        return list(self._compile(entity_filter_str).co_names)
+
+    def _compile(self, entity_filter_str: str) -> CodeType:
+        code = self._code_by_str.get(entity_filter_str)
+        if code is None:
+            code = compile(entity_filter_str, "<string>", "eval")
+            self._code_by_str[entity_filter_str] = code
+        return code
 
 
 class ExpressionParser:
@@ -367,13 +706,26 @@ class ExpressionParser:
         self._binop_by_name = binop_by_name
         self._prefix_unop_by_name = prefix_unop_by_name
         self._infix_unop_by_name = infix_unop_by_name
+        self._expression_by_str = {}
 
     def parse(self, expression_str: str) -> Expression:
+        expression = self._expression_by_str.get(expression_str)
+        if expression is None:
+            expression = self._parse(expression_str)
+            self._expression_by_str[expression_str] = expression
+        return expression
+
+    def _parse(self, expression_str: str) -> Expression:
         tokens = tokenize_expr(expression_str)
         tokens = ShuntingYard(False, self._binop_by_name,
                               self._prefix_unop_by_name,
                               self._infix_unop_by_name).process(tokens)
-        return lambda v: evaluate(tokens, {self._it_name: v})
+        it_name = self._it_name
+        if set(identifiers(tokens)) <= {it_name}:
+            # no dict per call
+            return compile_tokens(tokens, it_name)
+        compiled = compile_tokens(tokens)
+        return lambda v: compiled({it_name: v})
 
 
 class RiskyExpressionParser:
@@ -381,9 +733,16 @@ class RiskyExpressionParser:
 
     def __init__(self, it_name: str):
         self._it_name = it_name
+        self._expression_by_str = {}
 
     def parse(self, expression_str: str) -> Expression:
-        return lambda v: eval(expression_str, {}, {self._it_name: v})
+        expression = self._expression_by_str.get(expression_str)
+        if expression is None:
+            code = compile(expression_str, "<string>", "eval")
+            it_name = self._it_name
+            expression = lambda v: eval(code, {}, {it_name: v})
+            self._expression_by_str[expression_str] = expression
+        return expression
 
 
 class ColumnTransformationBuilder(abc.ABC):
@@ -407,7 +766,8 @@ class ColumnTransformationBuilder(abc.ABC):
         parser = self._transformation_builder.expression_parser()
         return parser.parse(col_filter_str)
 
-    def _parse_col_agg(self, col_agg_str: Optional[str]) -> Optional[ColAgg]:
+    def _parse_col_agg(self, col_agg_str: Optional[str]
+                       ) -> Optional[ColAgg]:
         if col_agg_str is None:
             return None
 
@@ -436,11 +796,17 @@ class ExistingColumnTransformationBuilder(ColumnTransformationBuilder):
         col_type = self._parse_col_type(col_type_str)
         col_filter = self._parse_col_filter(col_filter_str)
         col_map = self._parse_col_map(col_map_str)
-        col_agg = self._parse_col_agg(col_agg_str)
+        col_typecode = self._parse_col_typecode(col_type_str, col_map_str)
+        col_accumulator = self._parse_col_accumulator(col_agg_str,
+                                                      col_typecode)
+        if col_accumulator is None:
+            col_agg = self._parse_col_agg(col_agg_str)
+        else:
+            col_agg = accumulator_result
 
         return ExistingColumnTransformation(
             col_id, col_visible, col_type, col_filter, col_map, col_agg,
-            col_rename, col_order)
+            col_rename, col_order, col_typecode, col_accumulator)
 
     def _parse_col_id(self, col_id_str: str) -> ColRename:
         return lambda _name: col_id_str
@@ -455,6 +821,23 @@ class ExistingColumnTransformationBuilder(ColumnTransformationBuilder):
             parser = self._transformation_builder.expression_parser()
             return parser.parse(col_type_str)
 
+    def _parse_col_typecode(self, col_type_str: Optional[str],
+                            col_map_str: Optional[str]) -> Optional[str]:
+        if col_type_str is None or col_map_str is not None:
+            # a map may change the type of the values
+            return None
+
+        return self._transformation_builder.typecode_by_type(col_type_str)
+
+    def _parse_col_accumulator(self, col_agg_str: Optional[str],
+                               col_typecode: Optional[str]
+                               ) -> Optional[Callable[[], Accumulator]]:
+        if col_agg_str is None:
+            return None
+
+        return self._transformation_builder.accumulator_by_agg(col_agg_str,
+                                                               col_typecode)
+
     def _parse_col_map(self, col_map_str: str) -> Expression:
         if col_map_str is None:
             return id_func
@@ -480,6 +863,7 @@ class NewColumnDefinitionBuilder(ColumnTransformationBuilder):
         col_visible = self._parse_col_visible(col_visible)
         col_filter = self._parse_col_filter(col_filter_str)
         col_formula = self._parse_col_formula(col_formula_str)
+        col_formula_ids = self._parse_col_formula_ids(col_formula_str)
         if col_name_str is None:
             col_name = col_id_str
         else:
@@ -487,26 +871,40 @@ class NewColumnDefinitionBuilder(ColumnTransformationBuilder):
         col_agg = self._parse_col_agg(col_agg_str)
 
         return NewColumnDefinition(
-            col_id, col_visible, col_filter, col_formula, col_agg, col_name,
-            col_order)
+            col_id, col_visible, col_filter, col_formula, col_formula_ids,
+            col_agg, col_name, col_order)
 
     def _parse_col_formula(self, col_formula_str: str) -> Expression:
         parser = self._transformation_builder.row_filter_parser()
         return parser.parse(col_formula_str)
 
+    def _parse_col_formula_ids(self, col_formula_str: str) -> List[str]:
+        parser = self._transformation_builder.row_filter_parser()
+        return parser.identifiers(col_formula_str)
+
 
 class TransformationBuilder:
     def __init__(self, risky: bool, it_name: str, func_by_type, func_by_agg,
                  binop_by_name,
-                 prefix_unop_by_name, infix_unop_by_name):
+                 prefix_unop_by_name, infix_unop_by_name,
+                 typecode_by_type=None, accumulator_by_agg=None,
+                 accumulator_by_agg_by_typecode=None):
         self._risky = risky
         self._it_name = it_name
         self._func_by_type = func_by_type
+        self._typecode_by_type = ({} if typecode_by_type is None
+                                  else typecode_by_type)
         self._func_by_agg = func_by_agg
+        self._accumulator_by_agg = ({} if accumulator_by_agg is None
+                                    else accumulator_by_agg)
+        self._accumulator_by_agg_by_typecode = (
+            {} if accumulator_by_agg_by_typecode is None
+            else accumulator_by_agg_by_typecode)
         self._binop_by_name = binop_by_name
         self._prefix_unop_by_name = prefix_unop_by_name
         self._infix_unop_by_name = infix_unop_by_name
         self._entity_filter = cast(Expression, true_func)
+        self._entity_filter_ids = cast(Optional[List[str]], None)
         self._agg_filter = cast(EntityFilter, true_func)
         self._default_column_transformation = cast(
             Optional[DefaultColumnTransformation], None)
@@ -517,6 +915,15 @@ class TransformationBuilder:
             List[NewColumnDefinition], [])
         self._extra_prefix = "extra"
         self._extra_count = 1024
+        if risky:
+            self._row_filter_parser = RiskyEntityFilterParser()
+            self._expression_parser = RiskyExpressionParser(it_name)
+        else:
+            self._row_filter_parser = EntityFilterParser(
+                binop_by_name, prefix_unop_by_name, infix_unop_by_name)
+            self._expression_parser = ExpressionParser(
+                it_name, binop_by_name, prefix_unop_by_name,
+                infix_unop_by_name)
 
     def func_by_type(self, col_type_str: str) -> ColType:
         return self._func_by_type[col_type_str]
@@ -524,30 +931,41 @@ class TransformationBuilder:
     def func_by_agg(self, col_agg_str: str) -> ColAgg:
         return self._func_by_agg[col_agg_str]
 
+    def accumulator_by_agg(self, col_agg_str: str,
+                           col_typecode: Optional[str] = None
+                           ) -> Optional[Callable[[], Accumulator]]:
+        accumulator = self._accumulator_by_agg_by_typecode.get(
+            col_typecode, {}).get(col_agg_str)
+        if accumulator is None:
+            return self._accumulator_by_agg.get(col_agg_str)
+        return accumulator
+
+    def typecode_by_type(self, col_type_str: str) -> Optional[str]:
+        return self._typecode_by_type.get(col_type_str)
+
     def row_filter_parser(self) -> Union[
         RiskyEntityFilterParser, EntityFilterParser]:
-        if self._risky:
-            return RiskyEntityFilterParser()
-        else:
-            return EntityFilterParser(
-                self._binop_by_name, self._prefix_unop_by_name,
-                self._infix_unop_by_name)
+        """
+        :return: the parser, shared by all the columns: it caches the parsed
+                 strings
+        """
+        return self._row_filter_parser
 
     def expression_parser(self) -> Union[
         RiskyExpressionParser, ExpressionParser]:
-        if self._risky:
-            return RiskyExpressionParser(self._it_name)
-        else:
-            return ExpressionParser(
-                self._it_name, self._binop_by_name, self._prefix_unop_by_name,
-                self._infix_unop_by_name)
+        """
+        :return: the parser, shared by all the columns: it caches the parsed
+                 strings
+        """
+        return self._expression_parser
 
     def build(self) -> Transformation:
         return Transformation(self._entity_filter, self._agg_filter,
                               self._default_column_transformation,
                               self._col_transformation_by_name,
                               self._new_col_definitions,
-                              self._extra_prefix, self._extra_count)
+                              self._extra_prefix, self._extra_count,
+                              self._entity_filter_ids)
 
     def add_col(self, name: str, col_id_str: str, col_visible: bool,
                 col_type_str: str, col_filter_str: str, col_map_str: str,
@@ -571,6 +989,7 @@ class TransformationBuilder:
         parser = self.row_filter_parser()
         parse = parser.parse(entity_filter_str)
         self._entity_filter = parse
+        self._entity_filter_ids = parser.identifiers(entity_filter_str)
 
     def agg_filter(self, agg_filter_str: str):
         parser = self.row_filter_parser()
@@ -668,28 +1087,42 @@ def improve_header(header: List[str]) -> List[str]:
     c = collections.Counter(header)
     duplicates = set(k for k, v in c.items() if v > 1)
     seen = set(header)
+    # the last suffix tried for a name: the next search starts there
+    base_and_suffix_by_name = {}
     new_header = []
     for f in header:
         f = f.strip()
         if f in duplicates:
-            while f in seen:
-                m = SUFFIX_REGEX.match(f)
-                if m:
-                    base = m.group(1)
-                    v = int(m.group(2))
-                else:
-                    base = f
-                    v = 0
-                f = "{}_{}".format(base, v + 1)
+            base_and_suffix = base_and_suffix_by_name.get(f)
+            if base_and_suffix is None:
+                base, v = _split_suffix(f)
+            else:
+                base, v = base_and_suffix
+            base_ = base + "_"
+            new_f = f
+            while new_f in seen:
+                v += 1
+                new_f = base_ + str(v)
+            base_and_suffix_by_name[f] = base, v
+            f = new_f
 
         new_header.append(f)
         seen.add(f)
     return new_header
 
 
+def _split_suffix(name: str) -> Tuple[str, int]:
+    m = SUFFIX_REGEX.fullmatch(name)
+    if m:
+        return m.group(1), int(m.group(2))
+    else:
+        return name, 0
+
+
 def add_fields(fields, prefix="extra", total=1024):
     if len(fields) >= total:
         return fields
 
-    return fields + ["{}_{}".format(prefix, i) for i in
+    prefix_ = prefix + "_"
+    return fields + [prefix_ + str(i) for i in
                      range(1, total - len(fields) + 1)]
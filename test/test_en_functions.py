@@ -16,10 +16,11 @@
 #     You should have received a copy of the GNU General Public License
 #     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import locale
 import unittest
 
 from csv_transformer.en_functions import (
-    FUNC_BY_TYPE)
+    FUNC_BY_TYPE, FUNC_BY_AGG)
 
 import datetime as dt
 
@@ -41,15 +42,27 @@ class EnFunctionsTestCase(unittest.TestCase):
         self.assertEqual(FUNC_BY_TYPE["date_us"]("2017-05-12"),
                          dt.date(2017, 5, 12))
 
-    def test_float(self):
-        import locale
-        cur = locale.getlocale(locale.LC_NUMERIC)
-        locale.setlocale(locale.LC_NUMERIC, ('fr_FR', 'UTF-8'))
+    def test_count(self):
+        self.assertEqual(4, FUNC_BY_AGG["count"]([1, 2, 1, 3]))
+        self.assertEqual(3, FUNC_BY_AGG["count_distinct"]([1, 2, 1, 3]))
+
+
+class FrLocaleTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._cur = locale.getlocale(locale.LC_NUMERIC)
         try:
-            self.assertEqual(FUNC_BY_TYPE["float"]("1 235,7"), 1235.7)
-            self.assertEqual(FUNC_BY_TYPE["float_us"]("1235.7"), 1235.7)
-        finally:
-            locale.setlocale(locale.LC_NUMERIC, cur)
+            locale.setlocale(locale.LC_NUMERIC, ('fr_FR', 'UTF-8'))
+        except locale.Error:
+            raise unittest.SkipTest("fr_FR.UTF-8 locale not available")
+
+    @classmethod
+    def tearDownClass(cls):
+        locale.setlocale(locale.LC_NUMERIC, cls._cur)
+
+    def test_float(self):
+        self.assertEqual(FUNC_BY_TYPE["float"]("1 235,7"), 1235.7)
+        self.assertEqual(FUNC_BY_TYPE["float_us"]("1235.7"), 1235.7)
 
 
 if __name__ == '__main__':
@@ -16,12 +16,18 @@
 #     You should have received a copy of the GNU General Public License
 #     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import array
+import statistics
 import unittest
 from decimal import Decimal
 from unittest import mock
 from unittest.mock import Mock
 
-from csv_transformer.functions import age, str_to_decimal
+from csv_transformer.functions import (
+    age, str_to_decimal, str_to_date, strpdate, strpdatetime,
+    str_to_datetime, datetime_from_us_format,
+    CountAccumulator, SumAccumulator, MinAccumulator, MaxAccumulator,
+    FirstAccumulator, LastAccumulator, mean)
 import datetime as dt
 
 
@@ -46,6 +52,81 @@ class FunctionsTestCase(unittest.TestCase):
         self.assertEqual(Decimal("1005.56"), str_to_decimal("1005.56"))
         self.assertEqual(Decimal("1005.56"), str_to_decimal("1 005,56"))
 
+    def test_str_to_date_cache(self):
+        d = str_to_date("11/10/2020")
+        self.assertEqual(dt.date(2020, 10, 11), d)
+        self.assertIs(d, str_to_date("11/10/2020"))
+        with self.assertRaises(ValueError):
+            str_to_date("foo")
+
+    def test_strpdate(self):
+        self.assertEqual(dt.date(2020, 10, 11),
+                         strpdate("11.10.2020", "%d.%m.%Y"))
+        self.assertEqual(dt.datetime(2020, 10, 11, 12, 30),
+                         strpdatetime("11.10.2020 12:30", "%d.%m.%Y %H:%M"))
+        with self.assertRaises(ValueError):
+            strpdate("2020-10-11", "%d.%m.%Y")
+
+    def test_strpdate_cache(self):
+        d = strpdate("11.10.2020", "%d.%m.%Y")
+        self.assertIs(d, strpdate("11.10.2020", "%d.%m.%Y"))
+        d = strpdatetime("11.10.2020", "%d.%m.%Y")
+        self.assertIs(d, strpdatetime("11.10.2020", "%d.%m.%Y"))
+
+    def test_strpdate_locale(self):
+        # the month names depend on the locale: not cached
+        d = strpdate("11 Oct 2020", "%d %b %Y")
+        self.assertEqual(dt.date(2020, 10, 11), d)
+        self.assertIsNot(d, strpdate("11 Oct 2020", "%d %b %Y"))
+        d = strpdatetime("11 Oct 2020", "%d %b %Y")
+        self.assertIsNot(d, strpdatetime("11 Oct 2020", "%d %b %Y"))
+
+    def test_str_to_datetime_single_cache(self):
+        size = datetime_from_us_format.cache_info().currsize
+        d = str_to_datetime("1987-06-05 04:03:02")
+        self.assertEqual(dt.datetime(1987, 6, 5, 4, 3, 2), d)
+        self.assertIs(d, str_to_datetime("1987-06-05 04:03:02"))
+        self.assertEqual(size, datetime_from_us_format.cache_info().currsize)
+
+    def test_mean(self):
+        for values in [[1, 3], [1, 2], [-3, 0], [2 ** 62, 2 ** 62 + 1, 3],
+                       [2 ** 63 - 1, 2 ** 63 - 1, -7]]:
+            typed_values = array.array("q", values)
+            self.assertEqual(statistics.mean(values), mean(typed_values))
+            self.assertIs(type(statistics.mean(values)),
+                          type(mean(typed_values)))
+
+        self.assertEqual(statistics.mean([0.1, 0.2, 0.4]),
+                         mean(array.array("d", [0.1, 0.2, 0.4])))
+        with self.assertRaises(statistics.StatisticsError):
+            mean(array.array("q"))
+
+
+class AccumulatorTestCase(unittest.TestCase):
+    def test_accumulators(self):
+        values = [3, 1, 4, 1, 5, 9, 2, 6]
+        for accumulator_class, func in [
+            (CountAccumulator, len), (SumAccumulator, sum),
+            (MinAccumulator, min), (MaxAccumulator, max),
+            (FirstAccumulator, lambda xs: xs[0]),
+            (LastAccumulator, lambda xs: xs[-1]),
+        ]:
+            accumulator = accumulator_class()
+            for value in values:
+                accumulator.append(value)
+            self.assertEqual(func(values), accumulator.result())
+
+    def test_min_first(self):
+        accumulator = MinAccumulator()
+        for value in [2.0, 1.0, 1, 3]:
+            accumulator.append(value)
+        self.assertIsInstance(accumulator.result(), float)
+
+    def test_empty(self):
+        self.assertEqual(0, SumAccumulator().result())
+        with self.assertRaises(ValueError):
+            MaxAccumulator().result()
+
 
 if __name__ == '__main__':
     unittest.main()
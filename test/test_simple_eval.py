@@ -15,6 +15,8 @@
 #
 #     You should have received a copy of the GNU General Public License
 #     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import contextlib
+import io
 import operator
 import unittest
 from tokenize import TokenInfo, Token
@@ -28,92 +30,46 @@ import datetime as dt
 from csv_transformer.simple_eval import ShuntingYard
 
 
-class LiteralTestCase(unittest.TestCase):
-    def test_repr(self):
-        self.assertEqual("Literal('a')", repr(Literal("a")))
-
-    def test_eq(self):
-        self.assertEqual(Literal("a"), Literal("a"))
-        self.assertNotEqual(Literal("a"), Literal("b"))
-        self.assertNotEqual(Literal("a"), object())
-
-
-class IdentifierTestCase(unittest.TestCase):
-    def test_repr(self):
-        self.assertEqual("Identifier('a')", repr(Identifier("a")))
-
-    def test_eq(self):
-        self.assertEqual(Identifier("a"), Identifier("a"))
-        self.assertNotEqual(Identifier("a"), Identifier("b"))
-        self.assertNotEqual(Identifier("a"), object())
-
-
 def _f(x): return x
 
 
 def _g(x): return x
 
 
-class FunctionTestCase(unittest.TestCase):
+class TokenTestCase(unittest.TestCase):
     def test_repr(self):
-        self.assertEqual("Function('f')", repr(Function("f", _f)))
+        for expected, token in [
+            ("Literal('a')", Literal("a")),
+            ("Identifier('a')", Identifier("a")),
+            ("Function('f')", Function("f", _f)),
+            ("BinOp('bof')", BinOp("bof", True, True, _f)),
+            ("PrefixUnOp('bof')", PrefixUnOp("bof", True, True, _f)),
+            ("InfixUnOp('bof')", InfixUnOp("bof", True, True, _f)),
+        ]:
+            with self.subTest(expected=expected):
+                self.assertEqual(expected, repr(token))
 
     def test_eq(self):
-        self.assertEqual(Function("f", _f), Function("f", _f))
-        self.assertEqual(Function("f", _f), Function("f", _g))
-        self.assertNotEqual(Function("f", _f), Function("g", _f))
-        self.assertNotEqual(Function("f", _f), Function("g", _g))
-        self.assertNotEqual(Function("f", _f), object())
-
-
-class BinopTestCase(unittest.TestCase):
-    def test_repr(self):
-        self.assertEqual("BinOp('bof')", repr(BinOp("bof", True, True, _f)))
-
-    def test_eq(self):
-        self.assertEqual(BinOp("bof", True, True, _f),
-                         BinOp("bof", True, True, _f))
-        self.assertEqual(BinOp("bof", True, True, _f),
-                         BinOp("bof", True, True, _g))
-        self.assertNotEqual(BinOp("bof", True, True, _f),
-                            BinOp("bog", True, True, _f))
-        self.assertNotEqual(BinOp("bof", True, True, _f),
-                            BinOp("bog", True, True, _g))
-        self.assertNotEqual(BinOp("bof", True, True, _f), object())
-
-
-class PrefixUnOpTestCase(unittest.TestCase):
-    def test_repr(self):
-        self.assertEqual("PrefixUnOp('bof')",
-                         repr(PrefixUnOp("bof", True, True, _f)))
-
-    def test_eq(self):
-        self.assertEqual(PrefixUnOp("bof", True, True, _f),
-                         PrefixUnOp("bof", True, True, _f))
-        self.assertEqual(PrefixUnOp("bof", True, True, _f),
-                         PrefixUnOp("bof", True, True, _g))
-        self.assertNotEqual(PrefixUnOp("bof", True, True, _f),
-                            PrefixUnOp("bog", True, True, _f))
-        self.assertNotEqual(PrefixUnOp("bof", True, True, _f),
-                            PrefixUnOp("bog", True, True, _g))
-        self.assertNotEqual(PrefixUnOp("bof", True, True, _f), object())
-
-
-class InfixUnOpTestCase(unittest.TestCase):
-    def test_repr(self):
-        self.assertEqual("InfixUnOp('bof')",
-                         repr(InfixUnOp("bof", True, True, _f)))
-
-    def test_eq(self):
-        self.assertEqual(InfixUnOp("bof", True, True, _f),
-                         InfixUnOp("bof", True, True, _f))
-        self.assertEqual(InfixUnOp("bof", True, True, _f),
-                         InfixUnOp("bof", True, True, _g))
-        self.assertNotEqual(InfixUnOp("bof", True, True, _f),
-                            InfixUnOp("bog", True, True, _f))
-        self.assertNotEqual(InfixUnOp("bof", True, True, _f),
-                            InfixUnOp("bog", True, True, _g))
-        self.assertNotEqual(InfixUnOp("bof", True, True, _f), object())
+        for cls in [Literal, Identifier]:
+            with self.subTest(cls=cls.__name__):
+                self.assertEqual(cls("a"), cls("a"))
+                self.assertNotEqual(cls("a"), cls("b"))
+                self.assertNotEqual(cls("a"), object())
+
+    def test_eq_func(self):
+        for new in [
+            Function,
+            lambda name, func: BinOp(name, True, True, func),
+            lambda name, func: PrefixUnOp(name, True, True, func),
+            lambda name, func: InfixUnOp(name, True, True, func),
+        ]:
+            with self.subTest(cls=type(new("f", _f)).__name__):
+                self.assertEqual(new("f", _f), new("f", _f))
+                # the function is not compared
+                self.assertEqual(new("f", _f), new("f", _g))
+                self.assertNotEqual(new("f", _f), new("g", _f))
+                self.assertNotEqual(new("f", _f), new("g", _g))
+                self.assertNotEqual(new("f", _f), object())
 
 
 class MiscTestCase(unittest.TestCase):
@@ -261,18 +217,23 @@ class EvalTestCase(unittest.TestCase):
 
     def test_eval_expr_unary(self):
         self.assertEqual(-4, eval_expr("2*(-2)"))
-        self.assertEqual(4, eval_expr("2 + -round(-2.5)", debug=True))
-        self.assertEqual(-2, eval_expr("2 + -round(1.3+2.5)", debug=True))
+        self.assertEqual(4, eval_expr("2 + -round(-2.5)"))
+        self.assertEqual(-2, eval_expr("2 + -round(1.3+2.5)"))
         self.assertEqual(-4, eval_expr("-2*2"))
         self.assertEqual(-4, eval_expr("2*-2"))
         self.assertEqual(0, eval_expr("-2+2"))
         self.assertEqual(2, eval_expr("--2"))
         self.assertEqual(-2, eval_expr("-(-2+4)"))
-        self.assertEqual(1, eval_expr("2--2 - 3", debug=True))
-        self.assertEqual("2-8", eval_expr("format('{}{}', -round(-2.5), -2*4)",
-                                          debug=True))
+        self.assertEqual(1, eval_expr("2--2 - 3"))
+        self.assertEqual("2-8", eval_expr("format('{}{}', -round(-2.5), -2*4)"))
         self.assertEqual("2.5-8",
-                         eval_expr("format('{}{}', -(-2.5), -2*4)", debug=True))
+                         eval_expr("format('{}{}', -(-2.5), -2*4)"))
+
+    def test_eval_debug(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(1, eval_expr("2--2 - 3", debug=True))
+        self.assertIn("T: # | Opd: ", out.getvalue())
 
     def test_eval_expr(self):
         self.assertEqual(10, eval_expr("5*2"))
@@ -307,6 +268,10 @@ class EvalTestCase(unittest.TestCase):
         self.assertEqual(10, eval_expr("2*(2+x)", {"x": 3}))
         self.assertEqual(20, eval_expr("2*(2+x)*2", {"x": 3}))
 
+    def test_eval_stop_value(self):
+        stop = "".join(["ST", "OP"])  # a value read from a file
+        self.assertEqual("STOP", eval_expr("upper(x)", {"x": stop}))
+
     def test_eval_if(self):
         self.assertEqual(1, eval_expr("if(x > 2, 2, x)", {"x": 1}))
         self.assertEqual(2, eval_expr("if(x > 2, 2, x)", {"x": 2}))
@@ -383,6 +348,77 @@ class EvalTestCase(unittest.TestCase):
                 iter([TokenInfo(ENCODING, "", 1, 1, 1), TokenInfo(ENCODING, "", 1, 1, 1)]))
 
 
+class CompileTestCase(unittest.TestCase):
+    def test_compile(self):
+        for s, value_by_name in [
+            ("min((a+2)*3, 4*2)", {"a": 10}),
+            ("2 + -round(-2.5)", None),
+            ("format('{}{}', -(-2.5), -2*4)", None),
+            ("case(x > 2, 2, x < -2, -2, x)", {"x": -4}),
+            ("age(date('2014-02-12'), date('2013-01-13'))", None),
+        ]:
+            self.assertEqual(eval_expr(s, value_by_name),
+                             compile_expr(s)(value_by_name))
+
+    def test_compile_lazy(self):
+        # the other branch would divide by zero
+        self.assertEqual(0, compile_expr("if(x > 0, 1 / x, 0)")({"x": 0}))
+        self.assertEqual(0.5, compile_expr("if(x > 0, 1 / x, 0)")({"x": 2}))
+        self.assertEqual(0.5, compile_expr(
+            "case(x > 0, 1 / x, x < 0, -1 / x, 0)")({"x": -2}))
+        self.assertEqual(0, compile_expr(
+            "case(x > 0, 1 / x, x < 0, -1 / x, 0)")({"x": 0}))
+        with self.assertRaises(ZeroDivisionError):
+            eval_expr("if(x > 0, 1 / x, 0)", {"x": 0})
+
+    def test_compile_constant(self):
+        calls = []
+        f = Function("f", lambda x: calls.append(x) or x)
+        g = Function("g", lambda x: calls.append(x) or x, pure=False)
+        binop_by_name = {"+": BINOP_BY_NAME["+"], "(": BINOP_BY_NAME["("],
+                         ")": BINOP_BY_NAME[")"]}
+        for expr, expected_calls in [
+            ("f(1 + 2) + a", [3]),
+            ("g(1 + 2) + a", [3, 3]),
+            ("f(a) + 2", [1, 1]),
+        ]:
+            with self.subTest(expr=expr):
+                calls.clear()
+                tokens = ShuntingYard(False, binop_by_name, {"f": f, "g": g},
+                                      {}).process(tokenize_expr(expr))
+                compiled = compile_tokens(tokens)
+                compiled({"a": 1})
+                compiled({"a": 1})
+                self.assertEqual(expected_calls, calls)
+
+    def test_compile_constant_error(self):
+        compiled = compile_expr("1 / 0 + a")
+        with self.assertRaises(ZeroDivisionError):
+            compiled({"a": 1})
+
+    def test_compile_missing(self):
+        with self.assertRaises(KeyError):
+            compile_expr("a + 1")({})
+
+    def test_compile_arg(self):
+        tokens = ShuntingYard(False, BINOP_BY_NAME, PREFIX_UNOP_BY_NAME,
+                              INFIX_UNOP_BY_NAME).process(
+            tokenize_expr("min(it, 4) * 2"))
+        self.assertEqual(6, compile_tokens(tokens, "it")(3))
+        with self.assertRaises(ValueError):
+            compile_tokens(tokens, "x")
+
+    def test_err_compile(self):
+        with self.assertRaises(ValueError):
+            compile_expr("1+2.5,")
+
+
+def compile_expr(s: str) -> Callable[[Optional[Mapping[str, Any]]], Any]:
+    tokens = ShuntingYard(False, BINOP_BY_NAME, PREFIX_UNOP_BY_NAME,
+                          INFIX_UNOP_BY_NAME).process(tokenize_expr(s))
+    return compile_tokens(tokens)
+
+
 def eval_expr(s: str, value_by_name: Optional[Mapping[str, Any]] = None,
               debug=False) -> Any:
     tokens = tokenize_expr(s)
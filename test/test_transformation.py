@@ -141,6 +141,54 @@ class CSVTransformerWithoutAggTestCase(CSVTransformerTestCase):
             }
         }, csv_in_string, csv_out_string)
 
+    def test_short_row(self):
+        csv_in_string = "a,b\n1,2\n3"
+        csv_out_string = "a,b\r\n1,2\r\n3,\r\n"
+
+        self._test_transformation({}, csv_in_string, csv_out_string)
+
+    def test_pass_through(self):
+        csv_in_string = "a,b,c\n1,2,3\n4\n5,6,7,8"
+        csv_out_string = "A,c\r\n1,3\r\n4,\r\n5,7\r\n"
+
+        self._test_transformation({
+            "cols": {
+                "a": {"rename": "A"},
+                "b": {"visible": False},
+            }
+        }, csv_in_string, csv_out_string)
+
+    def test_entity_filter_first(self):
+        # the rows rejected by the filter are not typed
+        csv_in_string = "a,b\n1,x\n3,2\n4,1"
+        csv_out_string = "a,b,c\r\n3,2,6\r\n4,1,4\r\n"
+
+        self._test_transformation({
+            "entity_filter": "a > 2",
+            "cols": {
+                "a": {"type": "int"},
+                "b": {"type": "int"},
+            },
+            "new_cols": [
+                {"id": "c", "formula_path": "a * b"}
+            ]
+        }, csv_in_string, csv_out_string)
+
+    def test_entity_filter_new_col(self):
+        csv_in_string = "a,b\n1,2\n3,2\n4,1"
+        csv_out_string = "a,b,c\r\n3,2,6\r\n"
+
+        self._test_transformation({
+            "entity_filter": "c > 4",
+            "cols": {
+                "a": {"type": "int"},
+                "b": {"type": "int"},
+            },
+            "new_cols": [
+                {"id": "c", "formula_path": "a * b"}
+            ]
+        }, csv_in_string, csv_out_string)
+
     def test_default_normalize(self):
         csv_in_string = "À demain, été comme hiver\n1,2\n1,3"
         csv_out_string = "a_demain,ete_comme_hiver\r\n1,2\r\n1,3\r\n"
@@ -323,6 +371,58 @@ class CSVTransformerWithoutAggTestCase(CSVTransformerTestCase):
             ]
         }, csv_in_string, csv_out_string)
 
+    def test_new_col_map(self):
+        csv_in_string = "a\n1\n3"
+        csv_out_string = "a,b\r\n10,2\r\n30,4\r\n"
+
+        self._test_regular_transformation({
+            "cols": {
+                "a": {"type": "int", "map": "it * 10"},
+            },
+            "new_cols": [
+                {"id": "b", "formula_path": "a + 1"}
+            ]
+        }, csv_in_string, csv_out_string)
+
+    def test_new_col_dependencies(self):
+        csv_in_string = "a\n1\n3\n-2"
+        csv_out_string = "a,c,b\r\n1,4,2\r\n3,12,6\r\n-2,-8,-4\r\n"
+
+        self._test_transformation({
+            "cols": {
+                "a": {"type": "int"},
+            },
+            "new_cols": [
+                {"id": "c", "formula_path": "b * 2"},
+                {"id": "b", "formula_path": "a * 2"},
+            ]
+        }, csv_in_string, csv_out_string)
+
+    def test_new_col_same_id(self):
+        csv_in_string = "a\n1\n3"
+        csv_out_string = "a,a\r\n2,2\r\n4,4\r\n"
+
+        self._test_transformation({
+            "cols": {
+                "a": {"type": "int"},
+            },
+            "new_cols": [
+                {"id": "a", "formula_path": "a + 1"},
+            ]
+        }, csv_in_string, csv_out_string)
+
+    def test_new_col_circular_definition(self):
+        with self.assertRaises(ValueError):
+            self._apply_regular_transformation({
+                "cols": {
+                    "a": {"type": "int"},
+                },
+                "new_cols": [
+                    {"id": "c", "formula_path": "b * 2"},
+                    {"id": "b", "formula_path": "c + a"},
+                ]
+            }, "a\n1\n3")
+
     def test_new_col_agg(self):
         csv_in_string = "a\n1\n-2\n3\n1\n-2\n3"
         csv_out_string1 = "a,b\r\n4,1\r\n2,-1\r\n"
@@ -454,6 +554,103 @@ class CSVTransformerAggTestCase(CSVTransformerTestCase):
             }
         }, csv_in_string, csv_out_string)
 
+    def test_agg_short_row(self):
+        csv_in_string = "b,c,a\n2,x,1\n3,y,1\n5,z,2\n7,v\n1,w"
+        csv_out_string = "b,c,a\r\n5,\"x, y\",1\r\n5,z,2\r\n8,\"v, w\",\r\n"
+
+        self._test_transformation({
+            "cols": {
+                "b": {
+                    "type": "int",
+                    "agg": "sum"
+                },
+                "c": {
+                    "agg": "string_agg"
+                }
+            }
+        }, csv_in_string, csv_out_string)
+
+    def test_new_col_sum(self):
+        csv_in_string = "b,a\n2,1\n3,1\n5,2\n7"
+        csv_out_string = "a,c\r\n1,7\r\n2,6\r\n,8\r\n"
+
+        self._test_transformation({
+            "cols": {
+                "b": {
+                    "type": "int",
+                    "visible": False
+                }
+            },
+            "new_cols": [
+                {"id": "c", "formula_path": "b + 1", "agg": "sum"}
+            ]
+        }, csv_in_string, csv_out_string)
+
+    def test_int_sum(self):
+        csv_in_string = "a,b\n1,2\n1,3\n2,99999999999999999999"
+        csv_out_string = "a,b\r\n1,5\r\n2,99999999999999999999\r\n"
+
+        self._test_transformation({
+            "cols": {
+                "b": {
+                    "type": "int",
+                    "agg": "sum"
+                }
+            }
+        }, csv_in_string, csv_out_string)
+
+    def test_float_sum(self):
+        csv_in_string = "a,b\n" + "1,0.1\n" * 10
+        csv_out_string = "a,b\r\n1,{}\r\n".format(sum([0.1] * 10))
+
+        self._test_transformation({
+            "cols": {
+                "b": {
+                    "type": "float",
+                    "agg": "sum"
+                }
+            }
+        }, csv_in_string, csv_out_string)
+
+    def test_int_median(self):
+        csv_in_string = "a,b\n1,2\n1,99999999999999999999\n1,3\n2,4"
+        csv_out_string = "a,b\r\n1,3\r\n2,4\r\n"
+
+        self._test_transformation({
+            "cols": {
+                "b": {
+                    "type": "int",
+                    "agg": "median"
+                }
+            }
+        }, csv_in_string, csv_out_string)
+
+    def test_int_mean(self):
+        csv_in_string = "a,b\n1,2\n1,4\n2,9223372036854775807\n2,1"
+        csv_out_string = "a,b\r\n1,3\r\n2,4611686018427387904\r\n"
+
+        self._test_transformation({
+            "cols": {
+                "b": {
+                    "type": "int",
+                    "agg": "mean"
+                }
+            }
+        }, csv_in_string, csv_out_string)
+
+    def test_float_mean(self):
+        csv_in_string = "a,b\n1,78.38\n1,30.33\n1,47.66\n2,1e308\n2,1e308"
+        csv_out_string = "a,b\r\n1,52.12333333333333\r\n2,1e+308\r\n"
+
+        self._test_transformation({
+            "cols": {
+                "b": {
+                    "type": "float_us",
+                    "agg": "mean"
+                }
+            }
+        }, csv_in_string, csv_out_string)
+
     def test_agg(self):
         csv_in_string = "a,b\n1,2\n1,3"
         csv_out_string = "b\r\n5.0\r\n"
@@ -642,6 +839,86 @@ class CSVTransformerIntegrationTestCase(unittest.TestCase):
         transform(transformation_dict, csv_in, csv_out)
 
 
+class TransformationTestCase(unittest.TestCase):
+    def setUp(self):
+        self._transformation = self._parse({
+            "cols": {
+                "a": {"id": "A", "rename": "AA"},
+                "b": {"visible": False},
+            }
+        })
+
+    def _parse(self, transformation_dict):
+        builder = TransformationBuilder(
+            False, "it", FUNC_BY_TYPE, FUNC_BY_AGG, BINOP_BY_NAME,
+            PREFIX_UNOP_BY_NAME, INFIX_UNOP_BY_NAME)
+        return TransformationJsonParser(builder).parse(transformation_dict)
+
+    def test_create_key(self):
+        key = self._transformation.create_key(["A", "b", "c"])
+        self.assertEqual((), key({"A": 1, "b": 2, "c": 3}))
+
+    def test_agg_rows(self):
+        transformation = self._parse({
+            "cols": {"b": {"type": "int", "agg": "sum"}}
+        })
+        transformation.bind_header(["a", "b"])
+        transformation.take_or_ignore(["x", "1"])
+        transformation.take_or_ignore(["x", "2"])
+        self.assertEqual([{"a": "x", "b": 3}],
+                         list(transformation.agg_rows()))
+        self.assertEqual([], list(transformation.agg_rows()))
+
+    def test_bind_header(self):
+        binding = self._transformation.bind_header(["a", "b", "c"])
+        self.assertEqual(["AA", "c"], binding.file_header)
+        self.assertEqual(["A", "b", "c"], binding.col_ids)
+        self.assertEqual(["A", "c"], binding.visible_col_ids)
+
+    def test_bind_header_cache(self):
+        binding = self._transformation.bind_header(["a", "b", "c"])
+        self.assertIs(binding,
+                      self._transformation.bind_header(["a", "b", "c"]))
+        self.assertIsNot(binding,
+                         self._transformation.bind_header(["a", "b"]))
+
+    def test_file_header_cache(self):
+        header = ["a", "b", "c"]
+        self.assertEqual(["AA", "c"], self._transformation.file_header(header))
+        self.assertIs(self._transformation.file_header(header),
+                      self._transformation.bind_header(header).file_header)
+
+    def test_bind_header_funcs(self):
+        binding = self._transformation.bind_header(["a", "b", "c"])
+        self.assertEqual(["A", "b", "c"], binding.existing_col_ids)
+        self.assertEqual([None, None, None], binding.map_funcs)
+        self.assertEqual([None, None, None], binding.filter_funcs)
+        self.assertEqual(["A", "c"], binding.key_col_ids)
+        self.assertEqual((1, 3), binding.key_getter({"A": 1, "b": 2, "c": 3}))
+        self.assertFalse(binding.has_col_funcs)
+
+    def test_add_fields(self):
+        transformation = self._parse({
+            "extra": {"prefix": "ex", "count": 4}
+        })
+        self.assertEqual(["a", "b", "ex_1", "ex_2"],
+                         transformation.add_fields(["a", "b"]))
+        self.assertEqual(["c", "d", "ex_1", "ex_2"],
+                         transformation.add_fields(["c", "d"]))
+        self.assertEqual(["a", "b", "c", "d", "e"],
+                         transformation.add_fields(["a", "b", "c", "d", "e"]))
+
+    def test_is_pass_through(self):
+        self._transformation.bind_header(["a", "b", "c"])
+        self.assertTrue(self._transformation.is_pass_through())
+        self.assertEqual([0, 2], self._transformation.visible_positions())
+
+    def test_transform(self):
+        self._transformation.bind_header(["a", "b", "c"])
+        self.assertEqual({"A": "1", "b": "2", "c": "3"},
+                         self._transformation.transform(["1", "2", "3"]))
+
+
 class DefaultColumnTransformationTestCase(unittest.TestCase):
     def test_rename(self):
         df = DefaultColumnTransformation(True, False)
@@ -676,6 +953,23 @@ class ExpressionParserTestCase(unittest.TestCase):
                              INFIX_UNOP_BY_NAME).parse("x * 2")
         self.assertEqual(6, f(3))
 
+    def test_func_call(self):
+        parser = ExpressionParser("it", BINOP_BY_NAME, PREFIX_UNOP_BY_NAME,
+                                  INFIX_UNOP_BY_NAME)
+        self.assertIs(float, parser.parse("float(it)"))
+        self.assertEqual(2.0, parser.parse("float(it) * 2")("1"))
+
+    def test_cache(self):
+        parser = ExpressionParser("it", BINOP_BY_NAME, PREFIX_UNOP_BY_NAME,
+                                  INFIX_UNOP_BY_NAME)
+        self.assertIs(parser.parse("it * 2"), parser.parse("it * 2"))
+        self.assertIsNot(parser.parse("it * 2"), parser.parse("it * 3"))
+
+    def test_risky_cache(self):
+        parser = RiskyExpressionParser("it")
+        self.assertIs(parser.parse("it * 2"), parser.parse("it * 2"))
+        self.assertEqual(6, parser.parse("it * 2")(3))
+
 
 class HeaderTestCase(unittest.TestCase):
     def test_improve(self):
@@ -686,6 +980,12 @@ class HeaderTestCase(unittest.TestCase):
         self.assertEqual(["a_1", "_1", "b", "_2", "a_2", "_3"],
                          improve_header(["a", "", "b", "", "a", ""]))
 
+    def test_improve_many_duplicates(self):
+        self.assertEqual(["a_{}".format(i) for i in range(1, 501)],
+                         improve_header(["a"] * 500))
+        self.assertEqual(["a_1", "a_6", "a_2", "a_7"],
+                         improve_header(["a", "a_5", "a", "a_5"]))
+
     def test_add_fields(self):
         self.assertEqual(
             ['a', 'b', 'c', 'extra_1', 'extra_2', 'extra_3', 'extra_4',